@@ -1,11 +1,25 @@
 import ast
-from typing import Tuple, Set, Optional
+from functools import lru_cache
+from typing import Tuple, Set, Optional, FrozenSet
 from config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Bound once at import time; membership tests run for every visited node
+_FORBIDDEN_IMPORTS: FrozenSet[str] = frozenset(settings.FORBIDDEN_IMPORTS)
+_FORBIDDEN_BUILTINS: FrozenSet[str] = frozenset(settings.FORBIDDEN_BUILTINS)
+
+# Childless nodes that can never contain a security-relevant node; the walk
+# skips them instead of dispatching (operators and contexts dominate numeric code)
+_LEAF_TYPES = frozenset(
+    cls
+    for base in (ast.expr_context, ast.operator, ast.unaryop, ast.boolop, ast.cmpop)
+    for cls in base.__subclasses__()
+) | {ast.Constant}
+
+
 class SecurityError(Exception):
     """Raised when code contains security violations"""
     pass
@@ -17,6 +31,48 @@ class ASTSecurityValidator(ast.NodeVisitor):
     def __init__(self, forbidden_imports: Set[str], forbidden_builtins: Set[str]):
         self.forbidden_imports = forbidden_imports
         self.forbidden_builtins = forbidden_builtins
+        self.has_result = False
+        # Precomputed dispatch table avoids NodeVisitor's per-node getattr lookup
+        self._dispatch = {
+            ast.Import: self.visit_Import,
+            ast.ImportFrom: self.visit_ImportFrom,
+            ast.Name: self.visit_Name,
+            ast.Call: self.visit_Call,
+            ast.Attribute: self.visit_Attribute,
+            ast.Assign: self.visit_Assign,
+            ast.AnnAssign: self.visit_AnnAssign,
+        }
+
+    def visit(self, node: ast.AST) -> None:
+        """
+        Walk the tree with an explicit stack instead of recursion,
+        dispatching each node to its checker by exact type
+        """
+        dispatch = self._dispatch
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            check = dispatch.get(type(node))
+            if check is not None:
+                check(node)
+            # Reversed so nodes are checked (and violations reported) in source order
+            stack.extend(reversed([
+                child for child in ast.iter_child_nodes(node)
+                if type(child) not in _LEAF_TYPES
+            ]))
+
+    def visit_Assign(self, node: ast.Assign) -> None:
+        """Record assignment to the 'result' variable"""
+        if not self.has_result:
+            self.has_result = any(
+                isinstance(target, ast.Name) and target.id == 'result'
+                for target in node.targets
+            )
+
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> None:
+        """Record annotated assignment to the 'result' variable"""
+        if not self.has_result:
+            self.has_result = isinstance(node.target, ast.Name) and node.target.id == 'result'
 
     def visit_Import(self, node: ast.Import) -> None:
         """Check import statements"""
@@ -24,7 +80,6 @@ class ASTSecurityValidator(ast.NodeVisitor):
             module_name = alias.name.split('.')[0]
             if module_name in self.forbidden_imports:
                 raise SecurityError(f"Forbidden import: {alias.name}")
-        self.generic_visit(node)
 
     def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
         """Check from ... import statements"""
@@ -32,13 +87,11 @@ class ASTSecurityValidator(ast.NodeVisitor):
             module_name = node.module.split('.')[0]
             if module_name in self.forbidden_imports:
                 raise SecurityError(f"Forbidden import: from {node.module}")
-        self.generic_visit(node)
 
     def visit_Name(self, node: ast.Name) -> None:
         """Check for forbidden built-in functions"""
         if isinstance(node.ctx, ast.Load) and node.id in self.forbidden_builtins:
             raise SecurityError(f"Forbidden built-in function: {node.id}")
-        self.generic_visit(node)
 
     def visit_Call(self, node: ast.Call) -> None:
         """Check function calls for dangerous patterns"""
@@ -53,8 +106,6 @@ class ASTSecurityValidator(ast.NodeVisitor):
             if node.func.attr in ['eval', 'query']:
                 raise SecurityError(f"Forbidden method call: {node.func.attr}")
 
-        self.generic_visit(node)
-
     def visit_Attribute(self, node: ast.Attribute) -> None:
         """Check attribute access for dangerous patterns"""
         # Prevent access to dangerous dunder attributes
@@ -63,60 +114,55 @@ class ASTSecurityValidator(ast.NodeVisitor):
             safe_dunders = {'__name__', '__doc__', '__class__', '__dict__', '__str__', '__repr__', '__len__', '__getitem__'}
             if node.attr not in safe_dunders:
                 raise SecurityError(f"Forbidden dunder attribute: {node.attr}")
-        self.generic_visit(node)
+
+
+@lru_cache(maxsize=512)
+def parse_code(code: str) -> ast.Module:
+    """Parse code once and share the tree between validation passes (never mutated)"""
+    return ast.parse(code)
+
+
+@lru_cache(maxsize=512)
+def _validate_code_cached(code: str) -> Tuple[bool, Optional[str]]:
+    """Run the parse + validate pipeline; results are cached per code string"""
+    try:
+        tree = parse_code(code)
+    except SyntaxError as e:
+        return False, f"Syntax error at line {e.lineno}: {e.msg}"
+
+    # Walk through AST and check for forbidden patterns
+    validator = ASTSecurityValidator(_FORBIDDEN_IMPORTS, _FORBIDDEN_BUILTINS)
+
+    try:
+        validator.visit(tree)
+    except SecurityError as e:
+        logger.warning(f"Security validation failed: {e}")
+        return False, str(e)
+
+    # Check for required 'result' variable assignment (recorded during the walk)
+    if not validator.has_result:
+        return False, "Code must assign a value to variable 'result'"
+
+    return True, None
 
 
 class CodeValidator:
     """AST-based code validation for secure execution"""
 
-    def __init__(self):
-        self.forbidden_imports = set(settings.FORBIDDEN_IMPORTS)
-        self.forbidden_builtins = set(settings.FORBIDDEN_BUILTINS)
-
     def validate_code(self, code: str) -> Tuple[bool, Optional[str]]:
         """
         Validate code using AST parsing
         Returns: (is_valid, error_message)
         """
-        # Check for basic issues
-        if not code or not code.strip():
+        # Check for basic issues (cheapest checks first, none allocate)
+        if not code:
             return False, "Empty code provided"
 
         if len(code) > 10000:  # Reasonable code length limit
             return False, "Code exceeds maximum length of 10000 characters"
 
-        try:
-            tree = ast.parse(code)
-        except SyntaxError as e:
-            return False, f"Syntax error at line {e.lineno}: {e.msg}"
-
-        # Walk through AST and check for forbidden patterns
-        validator = ASTSecurityValidator(
-            self.forbidden_imports,
-            self.forbidden_builtins
-        )
-
-        try:
-            validator.visit(tree)
-        except SecurityError as e:
-            logger.warning(f"Security validation failed: {e}")
-            return False, str(e)
-
-        # Check for required 'result' variable assignment
-        has_result = self._check_result_assignment(tree)
-        if not has_result:
-            return False, "Code must assign a value to variable 'result'"
-
-        return True, None
-
-    def _check_result_assignment(self, tree: ast.AST) -> bool:
-        """Check if code assigns to 'result' variable"""
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if isinstance(target, ast.Name) and target.id == 'result':
-                        return True
-            elif isinstance(node, ast.AnnAssign):
-                if isinstance(node.target, ast.Name) and node.target.id == 'result':
-                    return True
-        return False
\ No newline at end of file
+        if code.isspace():
+            return False, "Empty code provided"
+
+        # Repeated submissions (retries, identical questions) hit the cache
+        return _validate_code_cached(code)
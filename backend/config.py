@@ -10,6 +10,7 @@ class Settings(BaseSettings):
     OPENAI_MODEL: str = "gpt-4o-mini"
     OPENAI_CODE_GENERATION_TEMPERATURE: float = 0.1
     OPENAI_INTERPRETATION_TEMPERATURE: float = 0.3
+    OPENAI_EMBEDDING_MODEL: str = "text-embedding-3-small"
 
     # Execution Limits
     MAX_EXECUTION_TIMEOUT: int = 5  # seconds
@@ -21,10 +22,19 @@ class Settings(BaseSettings):
     DEFAULT_SAMPLE_ROWS: int = 5
     MAX_SAMPLE_ROWS: int = 10
 
+    # DataFrame Cache (per worker process)
+    DATAFRAME_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # total DataFrame memory
+    DATAFRAME_CACHE_TTL: int = 600  # seconds
+
     # Conversation History
     MAX_CONVERSATION_HISTORY: int = 10
     CONTEXT_LOOKBACK: int = 3  # Number of previous interactions to include
 
+    # Semantic Response Cache
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # cosine similarity for a cache hit
+    SEMANTIC_CACHE_SIZE: int = 20  # most recent responses compared per session
+    SEMANTIC_CACHE_TTL: int = 86400  # seconds
+
     # Database Configuration
     MONGODB_URL: str = "mongodb://localhost:27017"
     DATABASE_NAME: str = "red_pandas_db"
@@ -1,5 +1,9 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
+import asyncio
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, WriteError
 from config import settings
 from models import ConversationContext
 import logging
@@ -7,6 +11,136 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class SessionWriteBatcher:
+    """Coalesce session updates from concurrent requests into bulk writes"""
+
+    def __init__(self, flush_interval: float = 0.05):
+        self.flush_interval = flush_interval
+        self._pending: List[Tuple[UpdateOne, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, collection, operation: UpdateOne) -> None:
+        """Queue an update and wait until its batch has been written"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_after_delay(collection))
+        await future
+
+    async def _flush_after_delay(self, collection) -> None:
+        """
+        Write everything queued during the flush interval in one round trip
+        Repeats while updates keep arriving; those submitted during a write
+        see this task still running and rely on it for the next batch
+        """
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            batch, self._pending = self._pending, []
+
+            try:
+                # Ordered, so several updates to one session apply in arrival order
+                await collection.bulk_write([operation for operation, _ in batch], ordered=True)
+            except BulkWriteError as e:
+                write_errors = e.details.get('writeErrors')
+                if not write_errors:
+                    # Every update was applied, but the write concern failed
+                    self._fail(batch, e)
+                    continue
+
+                # An ordered write stops at its first error: updates before it
+                # were applied, and those after it never ran, so they are retried
+                failed = write_errors[0]
+                index = failed['index']
+                self._resolve(batch[:index])
+                self._fail(batch[index:index + 1], WriteError(failed.get('errmsg'), failed.get('code'), failed))
+                self._pending = batch[index + 1:] + self._pending
+            except Exception as e:
+                self._fail(batch, e)
+            else:
+                self._resolve(batch)
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[UpdateOne, asyncio.Future]]) -> None:
+        """Complete the callers of applied updates"""
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[UpdateOne, asyncio.Future]], error: Exception) -> None:
+        """Raise the write error in the callers of failed updates"""
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+
+# Shared across requests; ConversationManager instances are per request
+_session_writes = SessionWriteBatcher()
+
+
+# Interaction fields returned to clients; question embeddings stay server-side
+HISTORY_PROJECTION = {
+    f"conversation_history.{field}": 1
+    for field in ("id", "timestamp", "question", "code", "result_summary", "interpretation", "error")
+}
+
+
+def question_similarities(
+    context: List[ConversationContext],
+    question_embedding: List[float]
+) -> np.ndarray:
+    """
+    Cosine similarity of each prior question to the new one
+    Returns: one similarity per context item, -inf for turns stored without a
+    comparable embedding (none, or one from a different embedding model)
+    """
+    similarities = np.full(len(context), -np.inf, dtype=np.float32)
+    embedded = [
+        i for i, ctx in enumerate(context)
+        if ctx.question_embedding and len(ctx.question_embedding) == len(question_embedding)
+    ]
+    if embedded:
+        matrix = np.asarray([context[i].question_embedding for i in embedded], dtype=np.float32)
+        query = np.asarray(question_embedding, dtype=np.float32)
+        similarities[embedded] = (matrix @ query) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+    return similarities
+
+
+def without_repeats(
+    context: List[ConversationContext],
+    question_embedding: List[float],
+    threshold: float
+) -> List[ConversationContext]:
+    """
+    Drop prior turns asking (nearly) the same question as the new one
+    Returns: the remaining context items, oldest first
+    """
+    similarities = question_similarities(context, question_embedding)
+    return [ctx for ctx, similarity in zip(context, similarities) if not similarity >= threshold]
+
+
+def select_relevant_context(
+    context: List[ConversationContext],
+    question_embedding: List[float],
+    k: int
+) -> List[ConversationContext]:
+    """
+    Pick the k prior interactions most similar to the new question
+    Selected turns keep their chronological order, so the same history always
+    produces the same prompt; turns stored without a comparable embedding
+    (none, or one from a different embedding model) rank last
+    Returns: at most k context items, oldest first
+    """
+    if len(context) <= k:
+        return context
+
+    similarities = question_similarities(context, question_embedding)
+
+    # Stable sort on reversed order, so ties go to the most recent turn
+    ranked = len(context) - 1 - np.argsort(-similarities[::-1], kind='stable')
+    return [context[i] for i in sorted(ranked[:k])]
+
+
 class ConversationManager:
     """Manage conversation context for better follow-up questions"""
 
@@ -20,25 +154,29 @@ class ConversationManager:
         code: str,
         result: Any,
         interpretation: str,
-        error: Optional[str] = None
+        error: Optional[str] = None,
+        question_embedding: Optional[List[float]] = None
     ) -> str:
         """Store interaction in session history"""
-        interaction_id = f"{session_id}_{datetime.now().timestamp()}"
+        now = datetime.now()
+        interaction_id = f"{session_id}_{now.timestamp()}"
 
         interaction = {
             "id": interaction_id,
-            "timestamp": datetime.now(),
+            "timestamp": now,
             "question": question,
             "code": code,
             "result_summary": self._summarize_result(result),
             "interpretation": interpretation,
-            "error": error,
-            "full_result": result  # Store full result for reference
+            "error": error
         }
+        if question_embedding is not None:
+            # Used to select relevant context for later questions
+            interaction["question_embedding"] = question_embedding
 
         try:
-            # Update session with new interaction
-            await self.db.sessions.update_one(
+            # Update session with new interaction (batched with concurrent writes)
+            await _session_writes.submit(self.db.sessions, UpdateOne(
                 {"_id": session_id},
                 {
                     "$push": {
@@ -48,7 +186,7 @@ class ConversationManager:
                         }
                     }
                 }
-            )
+            ))
             logger.info(f"Added interaction {interaction_id} to session {session_id}")
         except Exception as e:
             logger.error(f"Failed to add interaction to session: {e}")
@@ -59,18 +197,43 @@ class ConversationManager:
     async def get_conversation_context(
         self,
         session_id: str,
-        lookback: Optional[int] = None
+        lookback: Optional[int] = None,
+        question_embedding: Optional[List[float]] = None
+    ) -> List[ConversationContext]:
+        """
+        Get relevant context from previous interactions
+        With a question embedding, the lookback most similar turns of the stored
+        history are chosen; otherwise the most recent ones
+        """
+        candidates = await self.get_context_candidates(session_id, lookback, question_embedding)
+        context = self.select_context(candidates, question_embedding, lookback)
+        logger.info(f"Retrieved {len(context)} conversation context items for session {session_id}")
+        return context
+
+    async def get_context_candidates(
+        self,
+        session_id: str,
+        lookback: Optional[int] = None,
+        question_embedding: Optional[List[float]] = None
     ) -> List[ConversationContext]:
-        """Get relevant context from previous interactions"""
+        """
+        Fetch the stored turns select_context chooses from: the whole history
+        with a question embedding, otherwise only the most recent lookback turns
+        """
         lookback = lookback or settings.CONTEXT_LOOKBACK
+        candidates = settings.MAX_CONVERSATION_HISTORY if question_embedding is not None else lookback
 
         try:
-            session = await self.db.sessions.find_one({"_id": session_id})
+            # Slice server-side; the inclusion on _id keeps the rest of the
+            # session document (full dataset included) off the wire
+            session = await self.db.sessions.find_one(
+                {"_id": session_id},
+                {"_id": 1, "conversation_history": {"$slice": -candidates}}
+            )
             if not session or 'conversation_history' not in session:
                 return []
 
-            history = session['conversation_history']
-            recent_interactions = history[-lookback:] if len(history) > lookback else history
+            recent_interactions = session['conversation_history']
 
             context = []
             for interaction in recent_interactions:
@@ -78,15 +241,36 @@ class ConversationManager:
                     question=interaction['question'],
                     code=interaction['code'],
                     result_summary=interaction['result_summary'],
-                    timestamp=interaction['timestamp']
+                    timestamp=interaction['timestamp'],
+                    question_embedding=interaction.get('question_embedding')
                 ))
-
-            logger.info(f"Retrieved {len(context)} conversation context items for session {session_id}")
-            return context
         except Exception as e:
             logger.error(f"Failed to get conversation context: {e}")
             return []
 
+        return context
+
+    def select_context(
+        self,
+        context: List[ConversationContext],
+        question_embedding: Optional[List[float]],
+        lookback: Optional[int] = None,
+        exclude_repeats: bool = False
+    ) -> List[ConversationContext]:
+        """
+        Narrow candidate context to the turns included in the prompt
+        With exclude_repeats, earlier asks of the same question are left out first
+        """
+        lookback = lookback or settings.CONTEXT_LOOKBACK
+        if question_embedding is not None:
+            try:
+                if exclude_repeats:
+                    context = without_repeats(context, question_embedding, settings.SEMANTIC_CACHE_THRESHOLD)
+                return list(select_relevant_context(context, question_embedding, lookback))
+            except Exception as e:
+                logger.warning(f"Failed to rank conversation context, using most recent turns: {e}")
+        return list(context[-lookback:])
+
     def _summarize_result(self, result: Any) -> str:
         """Create concise summary of result for context"""
         if result is None:
@@ -135,14 +319,15 @@ class ConversationManager:
         if not context:
             return ""
 
-        formatted = "Previous conversation context:\n"
-        for i, ctx in enumerate(context, 1):
-            formatted += f"\n{i}. Question: {ctx.question}\n"
-            formatted += f"   Generated code snippet: {ctx.code[:200]}...\n" if len(ctx.code) > 200 else f"   Generated code: {ctx.code}\n"
-            formatted += f"   Result: {ctx.result_summary}\n"
-
-        formatted += "\nConsider this context when generating new code.\n"
-        return formatted
+        parts = ["Previous conversation context:\n"]
+        parts.extend(
+            f"\n{i}. Question: {ctx.question}\n"
+            + (f"   Generated code snippet: {ctx.code[:200]}...\n" if len(ctx.code) > 200 else f"   Generated code: {ctx.code}\n")
+            + f"   Result: {ctx.result_summary}\n"
+            for i, ctx in enumerate(context, 1)
+        )
+        parts.append("\nConsider this context when generating new code.\n")
+        return "".join(parts)
 
     async def clear_conversation_history(self, session_id: str) -> bool:
         """Clear conversation history for a session"""
@@ -160,10 +345,13 @@ class ConversationManager:
     async def get_full_history(self, session_id: str) -> List[Dict[str, Any]]:
         """Get full conversation history for a session"""
         try:
-            session = await self.db.sessions.find_one({"_id": session_id})
+            session = await self.db.sessions.find_one(
+                {"_id": session_id},
+                HISTORY_PROJECTION
+            )
             if not session or 'conversation_history' not in session:
                 return []
-            
+
             return session['conversation_history']
         except Exception as e:
             logger.error(f"Failed to get full history: {e}")
@@ -0,0 +1,313 @@
+import codecs
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from bson import Binary
+from bson.codec_options import TypeDecoder, TypeRegistry
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from config import settings
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # Fall back to the pandas C parser
+    pa = None
+    pa_csv = None
+
+logger = logging.getLogger(__name__)
+
+# Bytes sampled from the start of an upload to pick its encoding
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# MongoDB documents are capped at 16MB; larger datasets are stored in GridFS
+INLINE_DATA_LIMIT = 15 * 1024 * 1024
+
+# BSON binary subtype tagging stored Arrow IPC streams (0x80+ is user-defined)
+ARROW_BINARY_SUBTYPE = 0x80
+
+# Parsed session DataFrames as (stored_at, nbytes, df), most recently used
+# last and bounded by total memory. This is per worker process (fine for the
+# single-node MVP); executed code only ever sees a copy rebuilt in its
+# execution process, so cached frames are never modified
+_dataframe_cache: "OrderedDict[str, Tuple[float, int, pd.DataFrame]]" = OrderedDict()
+_dataframe_cache_bytes = 0
+
+
+class ArrowBufferDecoder(TypeDecoder):
+    """Decode Arrow-tagged binary fields straight into pyarrow buffers"""
+    bson_type = Binary
+
+    def transform_bson(self, value: Binary) -> Any:
+        if value.subtype == ARROW_BINARY_SUBTYPE:
+            # Wraps the decoded bytes without copying
+            return pa.py_buffer(value)
+        return value
+
+
+_arrow_type_registry = TypeRegistry([ArrowBufferDecoder()]) if pa is not None else None
+
+
+def session_collection(db):
+    """
+    Sessions collection whose stored Arrow data decodes to pyarrow buffers,
+    ready for load_dataframe (the plain collection when pyarrow is unavailable)
+    """
+    if _arrow_type_registry is None:
+        return db.sessions
+    return db.get_collection(
+        "sessions",
+        codec_options=db.codec_options.with_options(type_registry=_arrow_type_registry)
+    )
+
+
+def _normalize_temporal_columns(table: "pa.Table") -> "pa.Table":
+    """
+    Cast Arrow-inferred date/time columns to types pandas and BSON handle natively
+    (dates -> timestamps, times of day -> strings)
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_date(field.type):
+            target = pa.timestamp('ms')
+        elif pa.types.is_time(field.type):
+            target = pa.string()
+        else:
+            continue
+        table = table.set_column(i, field.name, table.column(i).cast(target))
+    return table
+
+
+def detect_encoding(file: BinaryIO) -> str:
+    """
+    Pick the upload's encoding from a sample of its first bytes
+    (BOM, then pure ASCII, then UTF-8 validity; latin-1 otherwise)
+    """
+    file.seek(0)
+    sample = file.read(ENCODING_SAMPLE_SIZE)
+
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.isascii():
+        return 'utf-8'
+    try:
+        # Incremental decoding tolerates a multi-byte character cut off at the sample end
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def read_csv_file(file: BinaryIO) -> Tuple[pd.DataFrame, Optional[Dict[str, int]]]:
+    """
+    Parse an uploaded CSV file object into a DataFrame
+    Reads the upload's spooled file directly (never materialized as one bytes
+    object) with PyArrow's multi-threaded reader when available, falling back
+    to the pandas C parser
+    Returns: (df, null_counts) where null_counts comes from Arrow metadata,
+    or None when pandas parsed the file
+    """
+    # Decided once from a sample, so the full upload is decoded a single time
+    encoding = detect_encoding(file)
+
+    if pa_csv is not None:
+        try:
+            file.seek(0)
+            table = pa_csv.read_csv(
+                file,
+                read_options=pa_csv.ReadOptions(
+                    use_threads=True,
+                    block_size=8 << 20,
+                    # Arrow reads UTF-8 natively (skipping any BOM) and transcodes other encodings
+                    encoding='utf8' if encoding.startswith('utf-8') else encoding
+                ),
+                convert_options=pa_csv.ConvertOptions(strings_can_be_null=True)
+            )
+            # Invalid UTF-8 past the sample is inferred as binary, and Arrow keeps
+            # duplicate or blank header names as-is; pandas handles both (renaming
+            # headers to e.g. 'a.1' and 'Unnamed: 1')
+            names = table.column_names
+            if len(set(names)) != len(names) or '' in names:
+                logger.info("CSV header has duplicate or blank column names, falling back to pandas")
+            elif any(pa.types.is_binary(field.type) for field in table.schema):
+                logger.info("CSV is not valid UTF-8, falling back to pandas")
+            else:
+                # Arrow tracks null counts per column, so this needs no data scan
+                null_counts = {
+                    field.name: table.column(i).null_count
+                    for i, field in enumerate(table.schema)
+                }
+                return _normalize_temporal_columns(table).to_pandas(), null_counts
+        except pa.ArrowInvalid as e:
+            logger.info(f"PyArrow could not parse CSV, falling back to pandas: {e}")
+
+    try:
+        file.seek(0)
+        return pd.read_csv(file, encoding=encoding, engine='c', low_memory=False, cache_dates=True), None
+    except UnicodeDecodeError:
+        # Invalid UTF-8 past the sampled bytes
+        file.seek(0)
+        return pd.read_csv(file, encoding='latin-1', engine='c', low_memory=False, cache_dates=True), None
+
+
+def summarize_columns(
+    df: pd.DataFrame,
+    null_counts: Optional[Dict[str, int]] = None
+) -> Tuple[Dict[str, int], List[str], List[str]]:
+    """
+    Collect null counts and numeric/categorical columns in one pass over the columns
+    Columns are only scanned for nulls when counts were not already known
+    Returns: (null_counts, numeric_columns, categorical_columns)
+    """
+    scan_nulls = null_counts is None
+    if scan_nulls:
+        null_counts = {}
+    numeric_columns = []
+    categorical_columns = []
+
+    for col, series in df.items():
+        if scan_nulls:
+            null_counts[col] = int(series.isna().sum())
+        dtype = series.dtype
+        if isinstance(dtype, np.dtype) and np.issubdtype(dtype, np.number):
+            numeric_columns.append(col)
+        elif dtype == object:
+            categorical_columns.append(col)
+
+    return null_counts, numeric_columns, categorical_columns
+
+
+def sample_records(df: pd.DataFrame, n: int) -> List[Dict[str, Any]]:
+    """First n rows as records, converted in bulk through Arrow when available"""
+    head = df.head(n)
+    if pa is not None:
+        try:
+            return pa.Table.from_pandas(head, preserve_index=False).to_pylist()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError):
+            pass  # Mixed-type object columns or duplicate names; use pandas conversion
+    return head.to_dict('records')
+
+
+def serialize_dataframe(df: pd.DataFrame, preserve_index: Optional[bool] = False) -> Optional[bytes]:
+    """
+    Serialize a DataFrame to an Arrow IPC stream
+    Returns: the stream bytes, or None when pyarrow is unavailable or cannot
+    represent the frame
+    """
+    if pa is None:
+        return None
+    try:
+        return pa.ipc.serialize_pandas(df, preserve_index=preserve_index).to_pybytes()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError) as e:
+        # e.g. object columns mixing types or duplicate column names
+        logger.warning(f"Could not serialize DataFrame to Arrow: {e}")
+        return None
+
+
+async def store_dataframe(db, session_id: str, df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Serialize the full dataset for the session document
+    Stored as one columnar Arrow IPC blob (inline, or in GridFS when too large);
+    falls back to a list of records when Arrow cannot be used
+    """
+    blob = serialize_dataframe(df)
+    if blob is not None:
+        if len(blob) > INLINE_DATA_LIMIT:
+            bucket = AsyncIOMotorGridFSBucket(db)
+            file_id = await bucket.upload_from_stream(f"{session_id}.arrow", blob)
+            return {"full_data_file_id": file_id}
+        return {"full_data_arrow": Binary(blob, ARROW_BINARY_SUBTYPE)}
+
+    return {"full_data": df.to_dict('records')}
+
+
+def deserialize_dataframe(blob: Union[bytes, "pa.Buffer"]) -> pd.DataFrame:
+    """
+    Rebuild a DataFrame from an Arrow IPC stream
+    The stream is read straight from the stored buffer, and self_destruct
+    frees Arrow columns as they are converted to keep peak memory down
+    """
+    if not isinstance(blob, pa.Buffer):
+        blob = pa.py_buffer(blob)  # GridFS downloads and untagged blobs
+    table = pa.ipc.open_stream(blob).read_all()
+    return table.to_pandas(self_destruct=True)
+
+
+def _restore_dtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """Cast columns rebuilt from records back to the dtypes recorded at upload"""
+    for col, dtype in dtypes.items():
+        if col in df.columns and str(df[col].dtype) != dtype:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Could not restore dtype {dtype} for column {col}: {e}")
+    return df
+
+
+async def load_dataframe(db, session: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Rebuild the session DataFrame from whichever storage format it uses
+    Arrow blobs carry their schema, so types are never re-inferred on reload
+    """
+    if "full_data_arrow" in session:
+        return deserialize_dataframe(session["full_data_arrow"])
+
+    if "full_data_file_id" in session:
+        bucket = AsyncIOMotorGridFSBucket(db)
+        stream = await bucket.open_download_stream(session["full_data_file_id"])
+        return deserialize_dataframe(await stream.read())
+
+    # Records format (sessions created without pyarrow or before Arrow storage)
+    return _restore_dtypes(pd.DataFrame(session["full_data"]), session.get("dtypes", {}))
+
+
+async def delete_dataframe(db, session: Dict[str, Any]) -> None:
+    """Remove dataset storage kept outside the session document"""
+    if "full_data_file_id" in session:
+        bucket = AsyncIOMotorGridFSBucket(db)
+        await bucket.delete(session["full_data_file_id"])
+
+
+def get_cached_dataframe(session_id: str) -> Optional[pd.DataFrame]:
+    """Return the cached DataFrame for a session if present and not expired"""
+    entry = _dataframe_cache.get(session_id)
+    if entry is None:
+        return None
+
+    stored_at, _, df = entry
+    if time.monotonic() - stored_at >= settings.DATAFRAME_CACHE_TTL:
+        evict_dataframe(session_id)
+        return None
+
+    _dataframe_cache.move_to_end(session_id)
+    return df
+
+
+def cache_dataframe(session_id: str, df: pd.DataFrame) -> None:
+    """
+    Cache a session DataFrame, evicting the least recently used frames beyond
+    the memory limit; frames larger than the whole limit are not cached
+    """
+    global _dataframe_cache_bytes
+    evict_dataframe(session_id)
+
+    # Deep size, so string (object) columns count their contents, not just
+    # pointers; measured once per insert, not on every hit
+    nbytes = int(df.memory_usage(index=True, deep=True).sum())
+    if nbytes > settings.DATAFRAME_CACHE_MAX_BYTES:
+        return
+
+    _dataframe_cache[session_id] = (time.monotonic(), nbytes, df)
+    _dataframe_cache_bytes += nbytes
+    while _dataframe_cache_bytes > settings.DATAFRAME_CACHE_MAX_BYTES:
+        _, (_, evicted_bytes, _) = _dataframe_cache.popitem(last=False)
+        _dataframe_cache_bytes -= evicted_bytes
+
+
+def evict_dataframe(session_id: str) -> None:
+    """Drop a session's cached DataFrame"""
+    global _dataframe_cache_bytes
+    entry = _dataframe_cache.pop(session_id, None)
+    if entry is not None:
+        _dataframe_cache_bytes -= entry[1]
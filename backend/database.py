@@ -58,6 +58,14 @@ async def create_indexes():
         
         # Create index on created_at for sorting
         await sessions_collection.create_index([("created_at", -1)])
+
+        # Semantic response cache: per-session, per-context lookups by recency, plus expiry
+        response_cache = db.database.response_cache
+        await response_cache.create_index([("session_id", 1), ("context_key", 1), ("created_at", -1)])
+        await response_cache.create_index(
+            "created_at",
+            expireAfterSeconds=settings.SEMANTIC_CACHE_TTL
+        )
         
         logger.info("Database indexes created successfully")
     except Exception as e:
@@ -2,24 +2,62 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import io
+import re
 from contextlib import redirect_stdout, redirect_stderr
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import marshal
+import multiprocessing
+import os
 import time
-from typing import Dict, Any, Tuple, Optional
+from functools import lru_cache
+from types import CodeType
+from typing import Dict, Any, Tuple, Optional, Union
 from datetime import datetime
 import math
 import statistics
 import logging
 
 from config import settings
-from code_validator import CodeValidator
-from models import ExecutionResult
+from code_validator import CodeValidator, parse_code
+from data_loader import serialize_dataframe, deserialize_dataframe
 
 logger = logging.getLogger(__name__)
 
-# Create thread pool executor for code execution
-executor = ThreadPoolExecutor(max_workers=2)
+# Each execution runs in its own process: user code runs outside the server's
+# GIL and memory space, and can be killed outright when it times out.
+# Processes are never forked from the (threaded) server itself: on Linux and
+# macOS they come from a single-threaded fork server that has already
+# imported this module, elsewhere (Windows) they are spawned from scratch
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    _mp_context = multiprocessing.get_context('forkserver')
+    _mp_context.set_forkserver_preload([__name__])
+else:
+    _mp_context = multiprocessing.get_context('spawn')
+
+# Limit concurrent executions to the number of cores
+_execution_slots = asyncio.Semaphore(os.cpu_count() or 1)
+
+# Error categories are tagged in a single regex pass over the message
+_ERROR_PATTERN = re.compile(
+    r"(?P<NameError>name .* is not defined)|(?P<KeyError>KeyError)|(?P<TypeError>TypeError)"
+    r"|(?P<ValueError>ValueError)|(?P<AttributeError>AttributeError)"
+)
+_ERROR_DESCRIPTIONS = {
+    'NameError': "Variable or function not found",
+    'KeyError': "Column not found in DataFrame",
+    'TypeError': "Type error in operation",
+    'ValueError': "Invalid value or operation",
+    'AttributeError': "Attribute error",
+}
+
+# Validator is stateless, so a single instance serves every execution
+validator = CodeValidator()
+
+
+@lru_cache(maxsize=256)
+def compile_code(code: str) -> CodeType:
+    """Compile code to a reusable code object, reusing the validator's parsed tree"""
+    return compile(parse_code(code), '<user>', 'exec')
 
 
 def format_and_truncate_result(result: Any) -> Tuple[Any, bool]:
@@ -30,27 +68,22 @@ def format_and_truncate_result(result: Any) -> Tuple[Any, bool]:
     truncated = False
 
     if isinstance(result, pd.DataFrame):
-        if len(result) > settings.MAX_SAMPLE_ROWS:
-            truncated = True
-            display_df = result.head(settings.MAX_SAMPLE_ROWS)
-        else:
-            display_df = result
+        # Serialization work is bounded by the sample size, not the result size
+        display_df = result.head(settings.MAX_SAMPLE_ROWS)
+        truncated = len(result) > settings.MAX_SAMPLE_ROWS
 
         return {
             'type': 'dataframe',
-            'data': display_df.to_dict('records'),
+            'data': display_df.to_dict(orient='records'),
             'shape': result.shape,
             'truncated': truncated,
             'total_rows': len(result),
-            'columns': result.columns.tolist()
+            'columns': list(result.columns)
         }, truncated
 
     elif isinstance(result, pd.Series):
-        if len(result) > settings.MAX_SAMPLE_ROWS:
-            truncated = True
-            display_series = result.head(settings.MAX_SAMPLE_ROWS)
-        else:
-            display_series = result
+        display_series = result.head(settings.MAX_SAMPLE_ROWS)
+        truncated = len(result) > settings.MAX_SAMPLE_ROWS
 
         return {
             'type': 'series',
@@ -61,13 +94,27 @@ def format_and_truncate_result(result: Any) -> Tuple[Any, bool]:
         }, truncated
 
     elif isinstance(result, (np.ndarray, np.generic)):
+        # Estimate the rendered size (~6 chars per element) before building any
+        # string, so large arrays never get fully converted and stringified
+        if result.size * 6 > settings.MAX_OUTPUT_SIZE:
+            truncated = True
+            # Only the leading elements that can fit in the output are converted;
+            # each renders to at least 3 characters with its separator
+            leading = result.flat[:settings.MAX_OUTPUT_SIZE // 3].tolist()
+            return {
+                'type': 'array',
+                'shape': result.shape,
+                'data': ('[' + ', '.join(map(repr, leading)))[:settings.MAX_OUTPUT_SIZE] + '...',
+                'truncated': truncated
+            }, truncated
+
         result_list = result.tolist()
         if isinstance(result_list, list) and len(str(result_list)) > settings.MAX_OUTPUT_SIZE:
             truncated = True
             # Truncate array representation
             return {
                 'type': 'array',
-                'shape': result.shape if hasattr(result, 'shape') else len(result),
+                'shape': result.shape,
                 'data': str(result_list)[:settings.MAX_OUTPUT_SIZE] + '...',
                 'truncated': truncated
             }, truncated
@@ -108,34 +155,14 @@ def format_and_truncate_result(result: Any) -> Tuple[Any, bool]:
         return result_str, truncated
 
 
-async def execute_code_safely(
-    df: pd.DataFrame,
-    code: str,
-    timeout: Optional[int] = None
-) -> Dict[str, Any]:
+def run_code(df: pd.DataFrame, code: CodeType) -> Tuple[Any, bool]:
     """
-    Execute generated code in a restricted environment with comprehensive error handling
+    Execute compiled code against df inside an execution process
+    Returns the formatted result so only JSON-ready data is sent back
     """
-    timeout = timeout or settings.MAX_EXECUTION_TIMEOUT
-    start_time = time.time()
-
-    # Validate code before execution (double-check)
-    validator = CodeValidator()
-    is_valid, validation_message = validator.validate_code(code)
-
-    if not is_valid:
-        logger.warning(f"Code validation failed: {validation_message}")
-        return ExecutionResult(
-            success=False,
-            output=None,
-            error=f"Code validation failed: {validation_message}",
-            execution_time=0,
-            truncated=False
-        ).dict()
-
     # Create restricted namespace with only safe libraries
     namespace = {
-        'df': df.copy(),  # Use copy to prevent modifications to original
+        'df': df,  # Rebuilt in the execution process, so private to this run
         'pd': pd,
         'np': np,
         'plt': plt,
@@ -151,77 +178,143 @@ async def execute_code_safely(
     error_buffer = io.StringIO()
 
     try:
-        # Run in executor with timeout
-        loop = asyncio.get_event_loop()
+        with redirect_stdout(output_buffer), redirect_stderr(error_buffer):
+            exec(code, namespace)
+
+        # Get the result variable
+        result = namespace.get('result')
+
+        # If no result but there's output, use the output
+        if result is None and output_buffer.getvalue():
+            result = output_buffer.getvalue().strip()
+    except Exception as e:
+        # Capture any execution errors
+        raise Exception(f"Execution error: {str(e)}")
+
+    # Format and potentially truncate result
+    return format_and_truncate_result(result)
+
+
+def _run_in_process(conn, data: Union[bytes, pd.DataFrame], code: bytes) -> None:
+    """
+    Process entry point: send (success, payload) back to the parent
+    data is the DataFrame as an Arrow IPC stream (or pickled with the call when
+    Arrow cannot represent it), code the marshalled code object
+    """
+    try:
+        df = deserialize_dataframe(data) if isinstance(data, bytes) else data
+        conn.send((True, run_code(df, marshal.loads(code))))
+    except Exception as e:
+        conn.send((False, str(e)))
+    finally:
+        conn.close()
+
+
+async def execute_code_safely(
+    df: pd.DataFrame,
+    code: str,
+    timeout: Optional[int] = None,
+    pre_validated: bool = False
+) -> Dict[str, Any]:
+    """
+    Execute generated code in a restricted environment with comprehensive error handling
+    Pass pre_validated=True only for code that already passed CodeValidator
+    """
+    timeout = timeout or settings.MAX_EXECUTION_TIMEOUT
+    start_time = time.time()
+
+    # Validate code before execution unless the caller already did
+    if pre_validated:
+        is_valid, validation_message = True, None
+    else:
+        is_valid, validation_message = validator.validate_code(code)
+
+    if not is_valid:
+        logger.warning(f"Code validation failed: {validation_message}")
+        return {
+            'success': False,
+            'output': None,
+            'error': f"Code validation failed: {validation_message}",
+            'execution_time': 0,
+            'truncated': False
+        }
+
+    try:
+        # Compiled in the server process, where the cache persists across
+        # executions; code objects cross to the child marshalled
+        compiled = marshal.dumps(compile_code(code))
+        # Columnar Arrow stream, keeping the index; much cheaper to rebuild than
+        # a pickled frame with string columns
+        data = serialize_dataframe(df, preserve_index=None)
+        if data is None:
+            data = df
+
+        async with _execution_slots:
+            loop = asyncio.get_running_loop()
+            receiver, sender = _mp_context.Pipe(duplex=False)
+            process = _mp_context.Process(
+                target=_run_in_process,
+                args=(sender, data, compiled),
+                daemon=True
+            )
+            process.start()
+            sender.close()
 
-        def run_code():
             try:
-                with redirect_stdout(output_buffer), redirect_stderr(error_buffer):
-                    exec(code, namespace)
-                
-                # Get the result variable
-                result = namespace.get('result')
-                
-                # If no result but there's output, use the output
-                if result is None and output_buffer.getvalue():
-                    return output_buffer.getvalue().strip()
-                
-                return result
-            except Exception as e:
-                # Capture any execution errors
-                raise Exception(f"Execution error: {str(e)}")
-
-        future = loop.run_in_executor(executor, run_code)
-
-        try:
-            result = await asyncio.wait_for(future, timeout=timeout)
-        except asyncio.TimeoutError:
-            logger.warning(f"Code execution timed out after {timeout} seconds")
-            return ExecutionResult(
-                success=False,
-                output=None,
-                error=f"Code execution timed out after {timeout} seconds. The operation may be too complex.",
-                execution_time=timeout,
-                truncated=False
-            ).dict()
+                # Wait off the event loop for the result (or the child exiting)
+                ready = await loop.run_in_executor(None, receiver.poll, timeout)
+                if not ready:
+                    logger.warning(f"Code execution timed out after {timeout} seconds")
+                    return {
+                        'success': False,
+                        'output': None,
+                        'error': f"Code execution timed out after {timeout} seconds. The operation may be too complex.",
+                        'execution_time': timeout,
+                        'truncated': False
+                    }
+
+                try:
+                    success, payload = receiver.recv()
+                except EOFError:
+                    raise Exception("Execution error: execution process exited unexpectedly")
+            finally:
+                # Anything still running (timed-out code) is killed, not orphaned
+                if process.is_alive():
+                    process.kill()
+                await loop.run_in_executor(None, process.join)
+                receiver.close()
+
+        if not success:
+            raise Exception(payload)
+        formatted_result, truncated = payload
 
         execution_time = time.time() - start_time
 
-        # Format and potentially truncate result
-        formatted_result, truncated = format_and_truncate_result(result)
-
         logger.info(f"Code executed successfully in {execution_time:.2f} seconds")
         
-        return ExecutionResult(
-            success=True,
-            output=formatted_result,
-            error=None,
-            execution_time=execution_time,
-            truncated=truncated
-        ).dict()
+        return {
+            'success': True,
+            'output': formatted_result,
+            'error': None,
+            'execution_time': execution_time,
+            'truncated': truncated
+        }
 
     except Exception as e:
         execution_time = time.time() - start_time
         error_message = str(e)
 
         # Clean up error messages for user-friendly display
-        if "name" in error_message and "is not defined" in error_message:
-            error_message = f"Variable or function not found: {error_message}"
-        elif "KeyError" in error_message:
-            error_message = f"Column not found in DataFrame: {error_message}"
-        elif "TypeError" in error_message:
-            error_message = f"Type error in operation: {error_message}"
-        elif "ValueError" in error_message:
-            error_message = f"Invalid value or operation: {error_message}"
-        elif "AttributeError" in error_message:
-            error_message = f"Attribute error: {error_message}"
+        match = _ERROR_PATTERN.search(error_message)
+        if match:
+            error_message = f"{_ERROR_DESCRIPTIONS[match.lastgroup]}: {error_message}"
 
         logger.error(f"Code execution failed: {error_message}")
 
-        return ExecutionResult(
-            success=False,
-            output=None,
-            error=error_message,
-            execution_time=execution_time,
-            truncated=False
-        ).dict()
\ No newline at end of file
+        return {
+            'success': False,
+            'output': None,
+            'error': error_message,
+            'execution_time': execution_time,
+            'truncated': False
+        }
\ No newline at end of file
@@ -1,9 +1,13 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from contextlib import asynccontextmanager
-import pandas as pd
+from typing import Any, Dict, Optional
 import numpy as np
-import io
+import orjson
+import pandas as pd
 import uuid
 from datetime import datetime
 import logging
@@ -15,11 +19,18 @@ from models import (
     AnalysisResponse, Session
 )
 from code_validator import CodeValidator
+from data_loader import (
+    read_csv_file, store_dataframe, load_dataframe, delete_dataframe,
+    get_cached_dataframe, cache_dataframe, evict_dataframe, sample_records,
+    summarize_columns, session_collection
+)
 from executor import execute_code_safely
-from conversation_manager import ConversationManager
+from conversation_manager import ConversationManager, HISTORY_PROJECTION
+from response_cache import ResponseCache, context_key
 from openai_client import (
-    OpenAIManager, create_code_generation_prompt,
-    clean_code_response, interpret_results
+    OpenAIManager, build_static_prefix, build_dynamic_suffix,
+    create_code_generation_messages, clean_code_response, interpret_results,
+    stream_interpretation, format_context_for_prompt
 )
 
 # Configure logging
@@ -29,6 +40,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Copy-on-Write lets executed code share the session DataFrame's buffers;
+# pandas only copies the blocks that user code actually modifies
+pd.set_option("mode.copy_on_write", True)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -46,7 +61,8 @@ app = FastAPI(
     title="Red Pandas API",
     description="LLM-powered data analytics API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -120,15 +136,8 @@ async def create_session(file: UploadFile = File(...)):
         )
 
     try:
-        # Read file contents
-        contents = await file.read()
-
-        # Try to parse CSV
-        try:
-            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        except UnicodeDecodeError:
-            # Try with different encoding
-            df = pd.read_csv(io.StringIO(contents.decode('latin-1')))
+        # Parse CSV straight from the spooled upload, off the event loop
+        df, null_counts = await run_in_threadpool(read_csv_file, file.file)
 
         # Validate dataframe
         if df.empty:
@@ -154,27 +163,34 @@ async def create_session(file: UploadFile = File(...)):
         # Extract metadata
         session_id = str(uuid.uuid4())
 
+        # Null counts and column kinds in a single pass over the columns
+        null_counts, numeric_columns, categorical_columns = summarize_columns(df, null_counts)
+
         # Get sample rows (configurable)
         sample_size = min(settings.DEFAULT_SAMPLE_ROWS, len(df))
 
+        db = get_database()
+
         session_data = {
             "_id": session_id,
             "filename": file.filename,
             "created_at": datetime.now(),
             "columns": df.columns.tolist(),
-            "dtypes": df.dtypes.astype(str).to_dict(),
+            "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
             "row_count": len(df),
             "column_count": len(df.columns),
-            "data_sample": df.head(sample_size).to_dict('records'),
-            "full_data": df.to_dict('records'),  # MVP: Store in MongoDB
+            "data_sample": sample_records(df, sample_size),
+            **await store_dataframe(db, session_id, df),  # Columnar Arrow blob
             "conversation_history": [],  # Initialize empty conversation history
-            "null_counts": df.isnull().sum().to_dict(),  # Track null values
-            "numeric_columns": df.select_dtypes(include=[np.number]).columns.tolist(),
-            "categorical_columns": df.select_dtypes(include=['object']).columns.tolist()
+            "null_counts": null_counts,  # Track null values
+            "numeric_columns": numeric_columns,
+            "categorical_columns": categorical_columns
         }
 
+        # Session metadata never changes, so the static prompt prefix is built once
+        session_data["static_prompt_prefix"] = build_static_prefix(session_data)
+
         # Store in MongoDB
-        db = get_database()
         await db.sessions.insert_one(session_data)
 
         logger.info(f"Created session {session_id} for file {file.filename}")
@@ -214,21 +230,68 @@ async def create_session(file: UploadFile = File(...)):
         )
 
 
-@app.post("/api/session/{session_id}/analyze", response_model=AnalysisResponse)
-async def analyze_data(session_id: str, query: Query):
+EXECUTION_ERROR_INTERPRETATION = "The analysis encountered an error. Please try rephrasing your question."
+
+
+async def prepare_analysis(session_id: str, query: Query) -> Dict[str, Any]:
     """
-    Analyze data by generating and executing Python code with full context
+    Shared analysis steps up to validated code, which execute_analysis runs
+    Returns: the question embedding and context key, plus either
+    "cached_response" on a semantic cache hit or the generated code and
+    the DataFrame to run it against
     """
-    # 1. Retrieve session
+    # 1. Retrieve session (without the dataset when it is already cached;
+    # history is read separately as conversation context)
     db = get_database()
-    session = await db.sessions.find_one({"_id": session_id})
+    df = get_cached_dataframe(session_id)
+    projection = {"conversation_history": 0}
+    if df is not None:
+        projection.update({"full_data": 0, "full_data_arrow": 0})
+    session = await session_collection(db).find_one({"_id": session_id}, projection)
 
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    # 2. Load data into DataFrame
+    # Embed the question once, for the semantic response cache and context selection
+    openai_manager = OpenAIManager()
+    question_embedding = None
+    try:
+        question_embedding = await openai_manager.create_embedding(query.question)
+    except Exception as e:
+        logger.warning(f"Question embedding failed, using recent context without caching: {e}")
+
+    # 2. Get conversation context (prior turns most relevant to the question)
+    conversation_manager = ConversationManager(db)
+    candidates = await conversation_manager.get_context_candidates(
+        session_id,
+        question_embedding=question_embedding
+    )
+    context = conversation_manager.select_context(candidates, question_embedding)
+
+    # Responses are only reused for the same conversation context, so a
+    # follow-up is never answered from a turn built on another context. Earlier
+    # asks of this question are left out of the key: the turn a response was
+    # cached from, and replays of it, were not part of the context it was built on
+    cache_context = conversation_manager.select_context(candidates, question_embedding, exclude_repeats=True)
+    analysis = {
+        "question_embedding": question_embedding,
+        "context_key": context_key(format_context_for_prompt(cache_context))
+    }
+
+    # Serve near-duplicate questions from the semantic response cache
+    if query.cache and question_embedding is not None:
+        cached_response = await ResponseCache(db).lookup(
+            session_id, question_embedding, analysis['context_key']
+        )
+        if cached_response:
+            analysis['cached_response'] = cached_response
+            return analysis
+
+    # 3. Load data into DataFrame
     try:
-        df = pd.DataFrame(session['full_data'])
+        if df is None:
+            df = await load_dataframe(db, session)
+            cache_dataframe(session_id, df)
     except Exception as e:
         logger.error(f"Error loading data: {e}")
         raise HTTPException(
@@ -236,40 +299,18 @@ async def analyze_data(session_id: str, query: Query):
             detail=f"Error loading data: {str(e)}"
         )
 
-    # 3. Get conversation context
-    conv_manager = ConversationManager(db)
-    context = await conv_manager.get_conversation_context(session_id)
-
-    # 4. Generate code using LLM with context
-    code_prompt = create_code_generation_prompt(
-        df_info={
-            'row_count': session['row_count'],
-            'column_count': session['column_count'],
-            'columns': session['columns'],
-            'dtypes': session['dtypes'],
-            'data_sample': session['data_sample'],
-            'numeric_columns': session.get('numeric_columns', []),
-            'categorical_columns': session.get('categorical_columns', []),
-            'null_counts': session.get('null_counts', {})
-        },
+    # 4. Generate code using LLM with context (static prompt prefix first for caching;
+    # stored at session creation, rebuilt only for sessions that predate it)
+    static_prefix = session.get('static_prompt_prefix') or build_static_prefix(session)
+    dynamic_suffix = build_dynamic_suffix(
         question=query.question,
         context=context  # Pass conversation context
     )
 
     try:
         # Call OpenAI API
-        openai_manager = OpenAIManager()
         generated_code = await openai_manager.generate_completion(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a data analyst. Generate only executable Python code with comments."
-                },
-                {
-                    "role": "user",
-                    "content": code_prompt
-                }
-            ],
+            messages=create_code_generation_messages(static_prefix, dynamic_suffix),
             temperature=settings.OPENAI_CODE_GENERATION_TEMPERATURE
         )
 
@@ -287,21 +328,12 @@ async def analyze_data(session_id: str, query: Query):
     is_valid, validation_message = validator.validate_code(generated_code)
 
     if not is_valid:
-        # Try to regenerate with more specific instructions
-        retry_prompt = code_prompt + f"\n\nPrevious attempt failed validation: {validation_message}\nPlease generate corrected code that assigns the result to 'result' variable."
+        # Try to regenerate with more specific instructions (keeping the cached prefix)
+        retry_suffix = dynamic_suffix + f"\n\nPrevious attempt failed validation: {validation_message}\nPlease generate corrected code that assigns the result to 'result' variable."
 
         try:
             generated_code = await openai_manager.generate_completion(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a data analyst. Generate only valid, executable Python code that assigns result to 'result' variable."
-                    },
-                    {
-                        "role": "user",
-                        "content": retry_prompt
-                    }
-                ],
+                messages=create_code_generation_messages(static_prefix, retry_suffix),
                 temperature=settings.OPENAI_CODE_GENERATION_TEMPERATURE
             )
 
@@ -323,38 +355,50 @@ async def analyze_data(session_id: str, query: Query):
                 detail=f"Error regenerating code: {str(e)}"
             )
 
+    analysis['generated_code'] = generated_code
+    analysis['df'] = df
+    return analysis
+
+
+async def execute_analysis(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Execute the prepared code (validated in step 5) and record its result"""
     # 6. Execute generated code
-    execution_result = await execute_code_safely(df, generated_code)
+    analysis['execution_result'] = await execute_code_safely(
+        analysis.pop('df'),
+        analysis['generated_code'],
+        pre_validated=True
+    )
+    return analysis['execution_result']
 
-    # 7. Interpret results
-    if execution_result['success']:
-        interpretation = await interpret_results(
-            question=query.question,
-            code=generated_code,
-            result=execution_result['output'],
-            openai_manager=openai_manager
-        )
-        error = None
-    else:
-        interpretation = f"The analysis encountered an error. Please try rephrasing your question."
-        error = execution_result['error']
+
+async def complete_analysis(
+    session_id: str,
+    query: Query,
+    analysis: Dict[str, Any],
+    interpretation: str,
+    error: Optional[str]
+) -> AnalysisResponse:
+    """Record an interpreted analysis in the conversation history and response cache"""
+    db = get_database()
+    execution_result = analysis['execution_result']
 
     # 8. Store interaction in conversation history
-    conversation_id = await conv_manager.add_interaction(
+    conversation_id = await ConversationManager(db).add_interaction(
         session_id=session_id,
         question=query.question,
-        code=generated_code,
+        code=analysis['generated_code'],
         result=execution_result['output'] if execution_result['success'] else None,
         interpretation=interpretation,
-        error=error
+        error=error,
+        question_embedding=analysis['question_embedding']
     )
 
     logger.info(f"Completed analysis for session {session_id}: {query.question[:50]}...")
 
-    # 9. Return response
-    return AnalysisResponse(
+    # 9. Build response
+    response = AnalysisResponse(
         question=query.question,
-        generated_code=generated_code,
+        generated_code=analysis['generated_code'],
         raw_result=execution_result['output'] if execution_result['success'] else None,
         interpretation=interpretation,
         error=error,
@@ -362,17 +406,170 @@ async def analyze_data(session_id: str, query: Query):
         conversation_id=conversation_id
     )
 
+    if query.cache and analysis['question_embedding'] is not None and error is None:
+        await ResponseCache(db).store(
+            session_id,
+            query.question,
+            analysis['question_embedding'],
+            analysis['context_key'],
+            response.model_dump()
+        )
+
+    return response
+
+
+async def complete_cached_analysis(
+    session_id: str,
+    query: Query,
+    analysis: Dict[str, Any]
+) -> AnalysisResponse:
+    """Record a semantic cache hit in the conversation history, like a fresh analysis"""
+    cached_response = analysis['cached_response']
+    conversation_id = await ConversationManager(get_database()).add_interaction(
+        session_id=session_id,
+        question=query.question,
+        code=cached_response['generated_code'],
+        result=cached_response['raw_result'],
+        interpretation=cached_response['interpretation'],
+        error=cached_response['error'],
+        question_embedding=analysis['question_embedding']
+    )
+
+    return AnalysisResponse(**{
+        **cached_response,
+        "question": query.question,
+        "conversation_id": conversation_id
+    })
+
+
+@app.post("/api/session/{session_id}/analyze", response_model=AnalysisResponse)
+async def analyze_data(session_id: str, query: Query):
+    """
+    Analyze data by generating and executing Python code with full context
+    """
+    analysis = await prepare_analysis(session_id, query)
+    if "cached_response" in analysis:
+        return await complete_cached_analysis(session_id, query, analysis)
+
+    execution_result = await execute_analysis(analysis)
+
+    # 7. Interpret results
+    if execution_result['success']:
+        interpretation = await interpret_results(
+            question=query.question,
+            code=analysis['generated_code'],
+            result=execution_result['output']
+        )
+        error = None
+    else:
+        interpretation = EXECUTION_ERROR_INTERPRETATION
+        error = execution_result['error']
+
+    return await complete_analysis(session_id, query, analysis, interpretation, error)
+
+
+# Execution results keep pandas/numpy values (timestamps, also as dict keys,
+# NaT and numpy scalars) that orjson cannot encode on its own
+_RESULT_ENCODERS = {
+    type(pd.NaT): lambda value: None,
+    np.generic: lambda value: value.item(),
+    np.ndarray: lambda value: value.tolist()
+}
+
+
+def ndjson_event(event: Dict[str, Any]) -> bytes:
+    """Encode one streamed event as a line of JSON"""
+    return orjson.dumps(
+        jsonable_encoder(event, custom_encoder=_RESULT_ENCODERS),
+        option=orjson.OPT_NON_STR_KEYS
+    ) + b"\n"
+
+
+@app.post("/api/session/{session_id}/analyze/stream")
+async def analyze_data_stream(session_id: str, query: Query):
+    """
+    Analyze data like /analyze, streaming newline-delimited JSON events as each
+    step finishes: generated code, execution result, interpretation text
+    deltas, then the complete response
+    """
+    # Failures up to code validation are returned as regular HTTP errors
+    analysis = await prepare_analysis(session_id, query)
+
+    async def events():
+        if "cached_response" in analysis:
+            cached_response = (await complete_cached_analysis(session_id, query, analysis)).model_dump()
+            yield ndjson_event({"type": "code", "code": cached_response["generated_code"]})
+            yield ndjson_event({
+                "type": "result",
+                "raw_result": cached_response["raw_result"],
+                "error": cached_response["error"],
+                "execution_time": cached_response["execution_time"]
+            })
+            yield ndjson_event({"type": "interpretation", "delta": cached_response["interpretation"]})
+            yield ndjson_event({"type": "done", "response": cached_response})
+            return
+
+        # The code reaches the client while it is still executing
+        yield ndjson_event({"type": "code", "code": analysis['generated_code']})
+        execution_result = await execute_analysis(analysis)
+        yield ndjson_event({
+            "type": "result",
+            "raw_result": execution_result['output'] if execution_result['success'] else None,
+            "error": execution_result['error'],
+            "execution_time": execution_result['execution_time']
+        })
+
+        # 7. Interpret results, forwarding text as it is generated
+        if execution_result['success']:
+            parts = []
+            try:
+                async for delta in stream_interpretation(
+                    question=query.question,
+                    code=analysis['generated_code'],
+                    result=execution_result['output']
+                ):
+                    parts.append(delta)
+                    yield ndjson_event({"type": "interpretation", "delta": delta})
+            except Exception as e:
+                yield ndjson_event({"type": "error", "detail": f"Error interpreting results: {str(e)}"})
+                return
+            interpretation = "".join(parts)
+            error = None
+        else:
+            interpretation = EXECUTION_ERROR_INTERPRETATION
+            error = execution_result['error']
+            yield ndjson_event({"type": "interpretation", "delta": interpretation})
+
+        response = await complete_analysis(session_id, query, analysis, interpretation, error)
+        yield ndjson_event({"type": "done", "response": response.model_dump()})
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 
 @app.get("/api/session/{session_id}")
 async def get_session(session_id: str):
     """Get session details and conversation history"""
     db = get_database()
-    session = await db.sessions.find_one({"_id": session_id})
+    # Only fetch the fields returned; the stored dataset can be tens of MB
+    session = await db.sessions.find_one(
+        {"_id": session_id},
+        {
+            "filename": 1,
+            "created_at": 1,
+            "columns": 1,
+            "dtypes": 1,
+            "row_count": 1,
+            "column_count": 1,
+            "data_sample": 1,
+            "numeric_columns": 1,
+            "categorical_columns": 1,
+            **HISTORY_PROJECTION
+        }
+    )
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Remove full_data from response (too large)
     session_response = {
         "id": session["_id"],
         "filename": session["filename"],
@@ -427,11 +624,19 @@ async def list_sessions(limit: int = 100, skip: int = 0):
 async def delete_session(session_id: str):
     """Delete a session and its data"""
     db = get_database()
-    result = await db.sessions.delete_one({"_id": session_id})
-    
-    if result.deleted_count == 0:
+    session = await db.sessions.find_one_and_delete(
+        {"_id": session_id},
+        projection={"full_data_file_id": 1}
+    )
+
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
+
+    evict_dataframe(session_id)
+    await delete_dataframe(db, session)
+
+    await db.response_cache.delete_many({"session_id": session_id})
+
     logger.info(f"Deleted session {session_id}")
     
     return {"message": "Session deleted successfully"}
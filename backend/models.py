@@ -36,6 +36,7 @@ class Session(BaseModel):
 class Query(BaseModel):
     """User's question about the data"""
     question: str = Field(..., min_length=1, max_length=1000)
+    cache: bool = True  # Set False to bypass the semantic response cache
 
     @validator('question')
     def clean_question(cls, v):
@@ -49,6 +50,7 @@ class ConversationContext(BaseModel):
     code: str
     result_summary: str
     timestamp: datetime
+    question_embedding: Optional[List[float]] = None
 
 
 class ExecutionResult(BaseModel):
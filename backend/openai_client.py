@@ -1,12 +1,18 @@
-from openai import AsyncOpenAI
-from typing import List, Dict, Optional, Any
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from typing import List, Dict, Optional, Any, AsyncIterator
+import httpx
 import pandas as pd
+import numpy as np
+import re
 import logging
 from config import settings
 from models import ConversationContext
 
 logger = logging.getLogger(__name__)
 
+# Optional opening ```/```python fence, the code, optional closing fence
+_CODE_FENCE_PATTERN = re.compile(r"\s*(?:```(?:python)?)?\s*(.*?)\s*(?:```)?\s*", re.DOTALL)
+
 
 class OpenAIManager:
     """Manages OpenAI API client and prompt generation"""
@@ -17,44 +23,80 @@ class OpenAIManager:
     def get_client(cls) -> AsyncOpenAI:
         """Get or create OpenAI client (singleton pattern)"""
         if cls._client is None:
-            cls._client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+            cls._client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                # Keep-alive HTTP/2 connections reused by every request in the process
+                http_client=DefaultAsyncHttpxClient(
+                    http2=True,
+                    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100)
+                )
+            )
             logger.info("OpenAI client initialized")
         return cls._client
 
     @classmethod
-    async def generate_completion(
+    async def stream_completion(
         cls,
         messages: List[Dict[str, str]],
         temperature: float = None,
         model: str = None
-    ) -> str:
-        """Generate completion with error handling"""
+    ) -> AsyncIterator[str]:
+        """Stream completion text as it is generated, with error handling"""
         client = cls.get_client()
         model = model or settings.OPENAI_MODEL
         temperature = temperature if temperature is not None else settings.OPENAI_CODE_GENERATION_TEMPERATURE
 
         try:
-            response = await client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
-                max_tokens=2000
+                max_tokens=2000,
+                stream=True
             )
-            return response.choices[0].message.content
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             raise Exception(f"OpenAI API error: {str(e)}")
 
+    @classmethod
+    async def generate_completion(
+        cls,
+        messages: List[Dict[str, str]],
+        temperature: float = None,
+        model: str = None
+    ) -> str:
+        """Generate completion with error handling (accumulated from the stream)"""
+        return "".join([
+            delta async for delta in cls.stream_completion(messages, temperature, model)
+        ])
 
-def create_code_generation_prompt(
-    df_info: dict,
-    question: str,
-    context: Optional[List[ConversationContext]] = None
-) -> str:
+    @classmethod
+    async def create_embedding(cls, text: str, model: str = None) -> List[float]:
+        """Embed text for semantic similarity lookups"""
+        client = cls.get_client()
+        model = model or settings.OPENAI_EMBEDDING_MODEL
+
+        try:
+            response = await client.embeddings.create(model=model, input=text)
+            return response.data[0].embedding
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise Exception(f"OpenAI API error: {str(e)}")
+
+
+CODE_GENERATION_SYSTEM_PROMPT = "You are a data analyst. Generate only executable Python code with comments."
+
+
+def build_static_prefix(df_info: dict) -> str:
     """
-    Create prompt for LLM to generate pandas code with conversation context
+    Create the session-specific part of the code generation prompt
+    Depends only on immutable session metadata, so it is byte-identical across
+    questions and OpenAI can serve it from its prompt cache
     """
-    prompt = f"""You are a data analyst writing Python code to analyze data.
+    return f"""You are a data analyst writing Python code to analyze data.
 
 You have a pandas DataFrame called 'df' with the following structure:
 
@@ -71,14 +113,6 @@ First {len(df_info['data_sample'])} rows of data:
 
 Null value counts per column:
 {format_null_counts(df_info.get('null_counts', {}))}
-"""
-
-    # Add conversation context if available
-    if context:
-        prompt += "\n" + format_context_for_prompt(context)
-
-    prompt += f"""
-Current question: {question}
 
 Generate Python code that:
 1. Uses the existing 'df' DataFrame (already loaded)
@@ -97,21 +131,46 @@ Important:
 
 Return ONLY executable Python code, no explanations or markdown.
 """
-    return prompt
+
+
+def build_dynamic_suffix(
+    question: str,
+    context: Optional[List[ConversationContext]] = None
+) -> str:
+    """
+    Create the per-question tail of the code generation prompt
+    (conversation context and the current question)
+    """
+    suffix = format_context_for_prompt(context) + "\n" if context else ""
+    return suffix + f"Current question: {question}\n"
+
+
+def create_code_generation_messages(static_prefix: str, dynamic_suffix: str) -> List[Dict[str, str]]:
+    """
+    Assemble code generation messages with all static content first,
+    so the cacheable prefix is shared by every question in a session
+    """
+    return [
+        {"role": "system", "content": CODE_GENERATION_SYSTEM_PROMPT},
+        {"role": "user", "content": static_prefix},
+        {"role": "user", "content": dynamic_suffix}
+    ]
 
 
 def format_column_info(columns: list, dtypes: dict) -> str:
     """Format column information for prompt"""
-    return "\n".join([f"- {col}: {dtypes.get(col, 'unknown')}" for col in columns])
+    return "\n".join(f"- {col}: {dtypes.get(col, 'unknown')}" for col in columns)
 
 
 def format_sample_data(sample: list) -> str:
-    """Format sample data as readable table"""
+    """Format sample data as a tab-separated table (no DataFrame round trip)"""
     if not sample:
         return "No data available"
     try:
-        df_sample = pd.DataFrame(sample)
-        return df_sample.to_string()
+        columns = list(sample[0])
+        lines = ["\t".join(map(str, columns))]
+        lines.extend("\t".join(str(row.get(col, '')) for col in columns) for row in sample)
+        return "\n".join(lines)
     except Exception as e:
         logger.error(f"Error formatting sample data: {e}")
         return str(sample)[:500]  # Fallback to string representation
@@ -121,13 +180,12 @@ def format_null_counts(null_counts: dict) -> str:
     """Format null counts for prompt"""
     if not null_counts:
         return "No information about null values"
-    
-    nulls_present = [f"- {col}: {count} null values" for col, count in null_counts.items() if count > 0]
-    
-    if nulls_present:
-        return "\n".join(nulls_present)
-    else:
-        return "No null values in the dataset"
+
+    # Filtered and joined in one pass; empty only when no column has nulls
+    nulls_present = "\n".join(
+        f"- {col}: {count} null values" for col, count in null_counts.items() if count > 0
+    )
+    return nulls_present or "No null values in the dataset"
 
 
 def format_context_for_prompt(context: List[ConversationContext]) -> str:
@@ -135,45 +193,24 @@ def format_context_for_prompt(context: List[ConversationContext]) -> str:
     if not context:
         return ""
 
-    formatted = "Previous conversation context:\n"
-    for i, ctx in enumerate(context, 1):
-        formatted += f"\n{i}. Question: {ctx.question}\n"
-        code_preview = ctx.code[:200] + "..." if len(ctx.code) > 200 else ctx.code
-        formatted += f"   Generated code snippet: {code_preview}\n"
-        formatted += f"   Result: {ctx.result_summary}\n"
-
-    formatted += "\nConsider this context when generating new code.\n"
-    return formatted
+    parts = ["Previous conversation context:\n"]
+    parts.extend(
+        f"\n{i}. Question: {ctx.question}\n"
+        f"   Generated code snippet: {ctx.code[:200] + '...' if len(ctx.code) > 200 else ctx.code}\n"
+        f"   Result: {ctx.result_summary}\n"
+        for i, ctx in enumerate(context, 1)
+    )
+    parts.append("\nConsider this context when generating new code.\n")
+    return "".join(parts)
 
 
 def clean_code_response(code: str) -> str:
     """Remove markdown formatting if present"""
-    code = code.strip()
-
-    # Remove markdown code blocks
-    if code.startswith("```python"):
-        code = code[9:]
-    elif code.startswith("```"):
-        code = code[3:]
-
-    if code.endswith("```"):
-        code = code[:-3]
-
-    return code.strip()
+    return _CODE_FENCE_PATTERN.fullmatch(code).group(1)
 
 
-async def interpret_results(
-    question: str,
-    code: str,
-    result: Any,
-    openai_manager: Optional[OpenAIManager] = None
-) -> str:
-    """
-    Ask LLM to interpret the execution results
-    """
-    if openai_manager is None:
-        openai_manager = OpenAIManager()
-
+def create_interpretation_messages(question: str, code: str, result: Any) -> List[Dict[str, str]]:
+    """Build the chat messages asking the LLM to interpret execution results"""
     # Format result for interpretation
     result_description = format_result_for_interpretation(result)
 
@@ -194,18 +231,48 @@ If the result was truncated, mention that only a sample is shown.
 Use business-friendly language and avoid technical jargon.
 """
 
+    return [
+        {
+            "role": "system",
+            "content": "You are a data analyst explaining results to a business user. Be concise and clear."
+        },
+        {
+            "role": "user",
+            "content": interpretation_prompt
+        }
+    ]
+
+
+def fallback_interpretation(result: Any) -> str:
+    """Basic interpretation used when the LLM call fails"""
+    if isinstance(result, dict) and result.get('type') == 'dataframe':
+        return f"Analysis completed successfully. The result is a table with {result['shape'][0]} rows and {result['shape'][1]} columns."
+    elif isinstance(result, (int, float)):
+        return f"The calculated result is: {result}"
+    else:
+        return "Analysis completed successfully. The results are shown above."
+
+
+async def interpret_results(
+    question: str,
+    code: str,
+    result: Any,
+    openai_manager: Optional[OpenAIManager] = None
+) -> str:
+    """
+    Ask LLM to interpret the execution results
+    """
+    # Scalars and single rows speak for themselves; skip the LLM round trip
+    direct_interpretation = interpret_simple_result(result)
+    if direct_interpretation is not None:
+        return direct_interpretation
+
+    if openai_manager is None:
+        openai_manager = OpenAIManager()
+
     try:
         interpretation = await openai_manager.generate_completion(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a data analyst explaining results to a business user. Be concise and clear."
-                },
-                {
-                    "role": "user",
-                    "content": interpretation_prompt
-                }
-            ],
+            messages=create_interpretation_messages(question, code, result),
             temperature=settings.OPENAI_INTERPRETATION_TEMPERATURE
         )
 
@@ -213,13 +280,71 @@ Use business-friendly language and avoid technical jargon.
 
     except Exception as e:
         logger.error(f"Failed to interpret results: {e}")
-        # Fallback to basic interpretation
-        if isinstance(result, dict) and result.get('type') == 'dataframe':
-            return f"Analysis completed successfully. The result is a table with {result['shape'][0]} rows and {result['shape'][1]} columns."
-        elif isinstance(result, (int, float)):
-            return f"The calculated result is: {result}"
-        else:
-            return "Analysis completed successfully. The results are shown above."
+        return fallback_interpretation(result)
+
+
+async def stream_interpretation(
+    question: str,
+    code: str,
+    result: Any,
+    openai_manager: Optional[OpenAIManager] = None
+) -> AsyncIterator[str]:
+    """
+    Stream the interpretation of execution results as the LLM generates it
+    Falls back to a basic interpretation if the LLM fails before any text arrives;
+    a failure partway through is raised
+    """
+    direct_interpretation = interpret_simple_result(result)
+    if direct_interpretation is not None:
+        yield direct_interpretation
+        return
+
+    if openai_manager is None:
+        openai_manager = OpenAIManager()
+
+    streamed = False
+    try:
+        async for delta in openai_manager.stream_completion(
+            messages=create_interpretation_messages(question, code, result),
+            temperature=settings.OPENAI_INTERPRETATION_TEMPERATURE
+        ):
+            streamed = True
+            yield delta
+    except Exception as e:
+        logger.error(f"Failed to interpret results: {e}")
+        if streamed:
+            raise
+        yield fallback_interpretation(result)
+
+
+def interpret_simple_result(result: Any) -> Optional[str]:
+    """Describe scalar and single-row results directly; None means the LLM should interpret"""
+    # Numpy scalars (e.g. df['col'].sum()) arrive formatted as zero-dimensional arrays
+    if isinstance(result, dict) and result.get('type') == 'array' and result.get('shape') == ():
+        result = result['data']
+
+    if isinstance(result, (bool, np.bool_)):
+        return f"The result is {result}."
+
+    if isinstance(result, (int, float, np.number)):
+        # Integers are often years or IDs, so only large fractional values get separators
+        if isinstance(result, (float, np.floating)) and abs(result) >= 10_000 and not float(result).is_integer():
+            return f"The result is {result:,}."
+        return f"The result is {result}."
+
+    if isinstance(result, dict) and result.get('type') == 'dataframe' and result['shape'][0] <= 1:
+        if not result['data']:
+            return "The analysis returned no matching rows."
+        row = ", ".join(f"{col}: {value}" for col, value in result['data'][0].items())
+        return f"The result is a single row: {row}."
+
+    if isinstance(result, dict) and result.get('type') == 'series' and result.get('length', 0) <= 1:
+        if not result['data']:
+            return "The analysis returned no values."
+        label, value = next(iter(result['data'].items()))
+        return f"The result is {label}: {value}."
+
+    return None
 
 
 def format_result_for_interpretation(result: Any) -> str:
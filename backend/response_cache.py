@@ -0,0 +1,74 @@
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+import hashlib
+import numpy as np
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def context_key(context: str) -> str:
+    """Fingerprint of the formatted conversation context a response was generated with"""
+    return hashlib.sha256(context.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Semantic cache of analysis responses, matched by question embedding"""
+
+    def __init__(self, db_connection):
+        self.db = db_connection
+
+    async def lookup(
+        self,
+        session_id: str,
+        embedding: List[float],
+        context_key: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached response for the most similar prior question, if similar
+        enough; only responses generated with the same conversation context match
+        """
+        try:
+            entries = await self.db.response_cache.find(
+                {"session_id": session_id, "context_key": context_key},
+                {"embedding": 1, "response": 1}
+            ).sort("created_at", -1).limit(settings.SEMANTIC_CACHE_SIZE).to_list(length=None)
+            if not entries:
+                return None
+
+            # Cosine similarity against every cached question in one matrix product
+            matrix = np.asarray([entry["embedding"] for entry in entries], dtype=np.float32)
+            query = np.asarray(embedding, dtype=np.float32)
+            similarities = (matrix @ query) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+
+            best = int(np.argmax(similarities))
+            if similarities[best] < settings.SEMANTIC_CACHE_THRESHOLD:
+                return None
+
+            logger.info(f"Semantic cache hit for session {session_id} (similarity {similarities[best]:.3f})")
+            return entries[best]["response"]
+        except Exception as e:
+            logger.error(f"Failed to look up cached response: {e}")
+            return None
+
+    async def store(
+        self,
+        session_id: str,
+        question: str,
+        embedding: List[float],
+        context_key: str,
+        response: Dict[str, Any]
+    ) -> None:
+        """Cache a successful analysis response under its question embedding"""
+        try:
+            await self.db.response_cache.insert_one({
+                "session_id": session_id,
+                "question": question,
+                "embedding": embedding,
+                "context_key": context_key,
+                "response": response,
+                "created_at": datetime.now()
+            })
+        except Exception as e:
+            logger.error(f"Failed to cache response: {e}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Settings require an API key at import time; tests never call OpenAI
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+# Backend modules are imported as top-level modules, as in main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
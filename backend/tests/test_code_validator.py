@@ -0,0 +1,77 @@
+import pytest
+from code_validator import CodeValidator
+
+validator = CodeValidator()
+
+
+def validate(code: str):
+    return validator.validate_code(code)
+
+
+@pytest.mark.parametrize("code", [
+    "def load():\n    import os\n    return 1\nresult = load()",
+    "try:\n    result = 1\nexcept Exception:\n    import subprocess\n",
+    "try:\n    result = 1\nexcept Exception:\n    pass\nelse:\n    from socket import socket\n",
+    "if df.empty:\n    result = 0\nelse:\n    import shutil.util\n",
+    "for col in df.columns:\n    from os.path import join\nresult = 1",
+])
+def test_forbidden_imports_in_nested_bodies(code):
+    is_valid, message = validate(code)
+
+    assert not is_valid
+    assert message.startswith("Forbidden import:")
+
+
+@pytest.mark.parametrize("code, name", [
+    ("f = lambda path: open(path)\nresult = 1", "open"),
+    ("result = f\"{eval('1 + 1')}\"", "eval"),
+    ("@vars\ndef f():\n    pass\nresult = 1", "vars"),
+    ("result = [exec(c) for c in ['1']]", "exec"),
+])
+def test_forbidden_builtins_in_nested_expressions(code, name):
+    assert validate(code) == (False, f"Forbidden built-in function: {name}")
+
+
+def test_dunder_attribute_in_comprehension():
+    code = "result = [c.__subclasses__() for c in [object]]"
+
+    assert validate(code) == (False, "Forbidden dunder attribute: __subclasses__")
+
+
+def test_safe_dunder_attribute_is_allowed():
+    assert validate("result = df.__class__.__name__") == (True, None)
+
+
+def test_first_violation_in_source_order_is_reported():
+    code = "x = open('data.csv')\nimport os\nresult = eval('1')"
+
+    assert validate(code) == (False, "Forbidden built-in function: open")
+
+    code = "import sys\nx = open('data.csv')\nresult = 1"
+
+    assert validate(code) == (False, "Forbidden import: sys")
+
+
+@pytest.mark.parametrize("code", [
+    "result: int = len(df)",
+    "total = result = len(df)",
+    "if len(df) > 0:\n    result = df.head()\nelse:\n    result = None",
+])
+def test_result_assignments_are_recognized(code):
+    assert validate(code) == (True, None)
+
+
+@pytest.mark.parametrize("code", [
+    "result, other = 1, 2",
+    "df.result = 1",
+    "result_df = df.head()",
+])
+def test_non_result_assignments_are_rejected(code):
+    assert validate(code) == (False, "Code must assign a value to variable 'result'")
+
+
+def test_basic_checks():
+    assert validate("") == (False, "Empty code provided")
+    assert validate("   \n") == (False, "Empty code provided")
+    assert validate("x" * 10001) == (False, "Code exceeds maximum length of 10000 characters")
+    assert validate("result = (")[1].startswith("Syntax error at line 1")
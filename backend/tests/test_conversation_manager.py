@@ -0,0 +1,177 @@
+import asyncio
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from conversation_manager import ConversationManager, SessionWriteBatcher, select_relevant_context, without_repeats
+from models import ConversationContext
+
+
+class FakeCollection:
+    """Records bulk writes; each write takes `delay` seconds"""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.batches = []
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.batches.append(operations)
+
+
+class FailingOpCollection:
+    """Applies ordered bulk writes until the op setting `fail_n`, like MongoDB"""
+
+    def __init__(self, fail_n: int):
+        self.fail_n = fail_n
+        self.applied = []
+        self.calls = 0
+
+    async def bulk_write(self, operations, ordered=True):
+        self.calls += 1
+        for index, operation in enumerate(operations):
+            n = operation._doc["$set"]["n"]
+            if n == self.fail_n:
+                raise BulkWriteError({
+                    "writeErrors": [{"index": index, "code": 10334, "errmsg": "document too large", "op": {}}],
+                    "nInserted": 0, "nUpserted": 0, "nMatched": index, "nModified": index, "nRemoved": 0,
+                    "upserted": [], "writeConcernErrors": []
+                })
+            self.applied.append(n)
+
+
+def update(n: int) -> UpdateOne:
+    return UpdateOne({"_id": "session"}, {"$set": {"n": n}})
+
+
+def test_concurrent_submits_share_one_bulk_write():
+    async def run():
+        batcher = SessionWriteBatcher(flush_interval=0.01)
+        collection = FakeCollection()
+        await asyncio.gather(*(batcher.submit(collection, update(n)) for n in range(5)))
+        return collection
+
+    collection = asyncio.run(run())
+    assert len(collection.batches) == 1
+    assert [op._doc["$set"]["n"] for op in collection.batches[0]] == list(range(5))
+
+
+def test_submit_during_write_is_flushed():
+    async def run():
+        batcher = SessionWriteBatcher(flush_interval=0.01)
+        collection = FakeCollection(delay=0.05)
+        first = asyncio.create_task(batcher.submit(collection, update(1)))
+        # Lands while the first batch's bulk_write is in flight
+        await asyncio.sleep(0.03)
+        await asyncio.wait_for(
+            asyncio.gather(first, batcher.submit(collection, update(2))),
+            timeout=1
+        )
+        return batcher, collection
+
+    batcher, collection = asyncio.run(run())
+    assert len(collection.batches) == 2
+    assert not batcher._pending
+
+
+def test_write_error_reaches_every_caller():
+    async def run():
+        batcher = SessionWriteBatcher(flush_interval=0.01)
+        collection = FakeCollection(error=RuntimeError("write failed"))
+        return await asyncio.gather(
+            batcher.submit(collection, update(1)),
+            batcher.submit(collection, update(2)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_failed_update_only_fails_its_own_caller():
+    async def run():
+        batcher = SessionWriteBatcher(flush_interval=0.01)
+        collection = FailingOpCollection(fail_n=2)
+        results = await asyncio.wait_for(asyncio.gather(
+            *(batcher.submit(collection, update(n)) for n in range(5)),
+            return_exceptions=True
+        ), timeout=1)
+        return collection, results
+
+    collection, results = asyncio.run(run())
+
+    assert [type(result).__name__ for result in results] == ["NoneType", "NoneType", "WriteError", "NoneType", "NoneType"]
+    assert results[2].code == 10334
+    # Updates after the failed one were retried in a second write, in order
+    assert collection.applied == [0, 1, 3, 4]
+    assert collection.calls == 2
+
+
+def context_item(question: str, embedding=None) -> ConversationContext:
+    return ConversationContext(
+        question=question,
+        code="result = 1",
+        result_summary="Numeric value: 1",
+        timestamp=datetime(2024, 1, 1),
+        question_embedding=embedding
+    )
+
+
+def questions(context):
+    return [ctx.question for ctx in context]
+
+
+def test_relevant_context_is_returned_in_chronological_order():
+    context = [
+        context_item("a", [1.0, 0.0]),
+        context_item("b", [0.0, 1.0]),
+        context_item("c", [0.9, 0.1]),
+        context_item("d", [0.1, 0.9]),
+    ]
+
+    assert questions(select_relevant_context(context, [0.0, 1.0], 2)) == ["b", "d"]
+    assert questions(select_relevant_context(context, [1.0, 0.0], 2)) == ["a", "c"]
+
+
+def test_ties_go_to_the_most_recent_turn():
+    context = [context_item(q, [1.0, 0.0]) for q in "abcd"]
+
+    assert questions(select_relevant_context(context, [1.0, 0.0], 2)) == ["c", "d"]
+
+
+def test_turns_without_comparable_embeddings_rank_last():
+    context = [
+        context_item("a", [0.0, 1.0]),
+        context_item("b"),
+        context_item("c", [1.0, 0.0, 0.0]),  # Different embedding model
+        context_item("d"),
+    ]
+
+    assert questions(select_relevant_context(context, [1.0, 0.0], 2)) == ["a", "d"]
+    assert questions(select_relevant_context(context[1:], [1.0, 0.0], 2)) == ["c", "d"]
+
+
+def test_short_history_is_returned_whole():
+    context = [context_item("a"), context_item("b")]
+
+    assert questions(select_relevant_context(context, [1.0, 0.0], 3)) == ["a", "b"]
+
+
+def test_ranking_failure_falls_back_to_recent_turns():
+    context = [context_item(q, [1.0, 0.0]) for q in "abcd"]
+    manager = ConversationManager(db_connection=None)
+
+    assert questions(manager.select_context(context, [float("nan"), "x"], 2)) == ["c", "d"]
+
+
+def test_repeats_of_the_question_are_left_out():
+    context = [
+        context_item("a", [1.0, 0.0]),
+        context_item("b", [0.0, 1.0]),
+        context_item("c"),
+        context_item("a again", [0.99, 0.01]),
+    ]
+
+    assert questions(without_repeats(context, [1.0, 0.0], 0.95)) == ["b", "c"]
@@ -0,0 +1,64 @@
+import asyncio
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import data_loader
+from config import settings
+from data_loader import (
+    read_csv_file, sample_records, store_dataframe,
+    cache_dataframe, get_cached_dataframe, evict_dataframe
+)
+
+
+def test_duplicate_and_blank_headers_are_renamed_like_pandas():
+    df, _ = read_csv_file(io.BytesIO(b"a,a,,b\n1,2,3,4\n5,6,7,8\n"))
+
+    assert list(df.columns) == ["a", "a.1", "Unnamed: 2", "b"]
+    assert sample_records(df, 1) == [{"a": 1, "a.1": 2, "Unnamed: 2": 3, "b": 4}]
+
+
+@pytest.mark.filterwarnings("ignore:DataFrame columns are not unique")
+def test_duplicate_column_names_fall_back_to_records():
+    df = pd.DataFrame([[1, 2], [3, 4]], columns=["a", "a"])
+
+    assert len(sample_records(df, 1)) == 1
+    assert "full_data" in asyncio.run(store_dataframe(None, "session", df))
+
+
+def test_arrow_parse_returns_null_counts():
+    df, null_counts = read_csv_file(io.BytesIO(b"x,y\n1,\n2,b\n"))
+
+    assert list(df.columns) == ["x", "y"]
+    assert null_counts == {"x": 0, "y": 1}
+
+
+def test_dataframe_cache_is_bounded_by_memory(monkeypatch):
+    frame = pd.DataFrame({"x": np.zeros(1000)})  # 8000 bytes of data
+    frame_bytes = int(frame.memory_usage().sum())
+    monkeypatch.setattr(settings, "DATAFRAME_CACHE_MAX_BYTES", frame_bytes * 2)
+
+    cache_dataframe("first", frame)
+    cache_dataframe("second", frame.copy())
+    assert get_cached_dataframe("first") is frame  # now most recently used
+    cache_dataframe("third", frame.copy())
+    cache_dataframe("too-large", pd.DataFrame({"x": np.zeros(10000)}))
+
+    assert get_cached_dataframe("second") is None
+    assert get_cached_dataframe("first") is frame
+    assert get_cached_dataframe("third") is not None
+    assert get_cached_dataframe("too-large") is None
+
+    for session_id in ("first", "third"):
+        evict_dataframe(session_id)
+    assert data_loader._dataframe_cache_bytes == 0
+
+
+def test_dataframe_cache_counts_string_contents(monkeypatch):
+    frame = pd.DataFrame({"text": ["a much longer string value " * 4] * 1000})
+    monkeypatch.setattr(settings, "DATAFRAME_CACHE_MAX_BYTES", int(frame.memory_usage().sum()) * 2)
+
+    cache_dataframe("strings", frame)
+
+    assert get_cached_dataframe("strings") is None
+    assert data_loader._dataframe_cache_bytes == 0
@@ -0,0 +1,57 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import pytest
+from config import settings
+from executor import compile_code, execute_code_safely, format_and_truncate_result
+
+
+def test_repeated_code_is_compiled_once_in_the_server_process():
+    df = pd.DataFrame({"a": range(10)})
+    code = "result = df['a'].sum() + 1"
+    compile_code.cache_clear()
+
+    async def run():
+        return [await execute_code_safely(df, code) for _ in range(3)]
+
+    results = asyncio.run(run())
+
+    assert [r["output"] for r in results] == [{"type": "array", "data": 46, "shape": ()}] * 3
+    info = compile_code.cache_info()
+    assert (info.misses, info.hits) == (1, 2)
+
+
+def test_syntax_error_is_reported_not_raised():
+    df = pd.DataFrame({"a": [1]})
+
+    result = asyncio.run(execute_code_safely(df, "result = (", pre_validated=True))
+
+    assert not result["success"]
+    assert "invalid syntax" in result["error"] or "was never closed" in result["error"]
+
+
+def test_large_array_output_keeps_leading_elements_up_to_the_limit():
+    formatted, truncated = format_and_truncate_result(np.arange(100000))
+
+    assert truncated
+    assert formatted["shape"] == (100000,)
+    assert formatted["data"].startswith("[0, 1, 2, 3, ")
+    assert formatted["data"].endswith("...")
+    assert len(formatted["data"]) == settings.MAX_OUTPUT_SIZE + 3
+
+
+def test_execution_process_sees_the_frame_and_its_index():
+    df = pd.DataFrame({"a": [1.5, 2.5], "b": ["x", "y"]}, index=pd.Index([10, 20], name="id"))
+
+    result = asyncio.run(execute_code_safely(df, "result = f\"{df.index.name}:{df.index.tolist()}:{df.loc[20, 'b']}\""))
+
+    assert result["output"] == "id:[10, 20]:y"
+
+
+@pytest.mark.filterwarnings("ignore:DataFrame columns are not unique")
+def test_frame_arrow_cannot_represent_is_still_executed():
+    df = pd.DataFrame([[1, 2], [3, 4]], columns=["a", "a"])
+
+    result = asyncio.run(execute_code_safely(df, "result = int(df.values.sum())"))
+
+    assert result["output"] == 10
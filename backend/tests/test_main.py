@@ -0,0 +1,140 @@
+import asyncio
+import numpy as np
+import orjson
+import pandas as pd
+import main
+from main import ndjson_event
+from models import Query
+from openai_client import OpenAIManager
+from test_response_cache import FakeCollection
+
+
+def test_ndjson_event_encodes_pandas_and_numpy_values():
+    event = {
+        "type": "result",
+        "raw_result": {
+            "type": "series",
+            "data": {pd.Timestamp("2024-01-31"): np.int64(3), pd.Timestamp("2024-02-29"): np.float64("nan")},
+            "rows": [{"date": pd.Timestamp("2024-01-31 12:00"), "missing": pd.NaT, "values": np.arange(2)}]
+        }
+    }
+
+    line = ndjson_event(event)
+
+    assert line.endswith(b"\n")
+    assert orjson.loads(line)["raw_result"] == {
+        "type": "series",
+        "data": {"2024-01-31T00:00:00": 3, "2024-02-29T00:00:00": None},
+        "rows": [{"date": "2024-01-31T12:00:00", "missing": None, "values": [0, 1]}]
+    }
+
+
+def test_stream_sends_code_before_executing_it(monkeypatch):
+    steps = []
+
+    async def prepare_analysis(session_id, query):
+        steps.append("prepare")
+        return {"generated_code": "result = 1", "df": pd.DataFrame()}
+
+    async def execute_code_safely(df, code, pre_validated=False):
+        steps.append("execute")
+        return {"success": False, "output": None, "error": "failed", "execution_time": 0.0}
+
+    async def complete_analysis(session_id, query, analysis, interpretation, error):
+        return main.AnalysisResponse(
+            question=query.question,
+            generated_code=analysis["generated_code"],
+            raw_result=None,
+            interpretation=interpretation,
+            error=error,
+            execution_time=analysis["execution_result"]["execution_time"],
+            conversation_id="turn"
+        )
+
+    monkeypatch.setattr(main, "prepare_analysis", prepare_analysis)
+    monkeypatch.setattr(main, "execute_code_safely", execute_code_safely)
+    monkeypatch.setattr(main, "complete_analysis", complete_analysis)
+
+    async def run():
+        response = await main.analyze_data_stream("session", Query(question="total?"))
+        assert steps == ["prepare"]
+        events = []
+        async for line in response.body_iterator:
+            events.append(orjson.loads(line)["type"])
+            steps.append(events[-1])
+        return events
+
+    events = asyncio.run(run())
+
+    assert events == ["code", "result", "interpretation", "done"]
+    assert steps[:3] == ["prepare", "code", "execute"]
+
+
+class FakeSessions:
+    """One session document; applies the batched history pushes"""
+
+    def __init__(self, document):
+        self.document = document
+
+    async def find_one(self, query, projection=None):
+        history = self.document["conversation_history"]
+        if projection and "$slice" in str(projection.get("conversation_history")):
+            return {"_id": self.document["_id"], "conversation_history": history[projection["conversation_history"]["$slice"]:]}
+        return dict(self.document)
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            push = operation._doc["$push"]["conversation_history"]
+            history = self.document["conversation_history"] + push["$each"]
+            self.document["conversation_history"] = history[push["$slice"]:]
+
+
+class FakeAnalysisDatabase:
+    def __init__(self, session):
+        self.sessions = FakeSessions(session)
+        self.response_cache = FakeCollection()
+
+
+def test_repeated_question_is_served_from_the_response_cache(monkeypatch):
+    embeddings = {"total of a": [1.0, 0.0], "mean of a": [0.0, 1.0]}
+    generated = []
+
+    async def create_embedding(cls, text, model=None):
+        return embeddings[text]
+
+    async def generate_completion(cls, messages, temperature=None, model=None):
+        generated.append(messages)
+        return "result = df['a'].sum()"
+
+    db = FakeAnalysisDatabase({
+        "_id": "session",
+        "static_prompt_prefix": "Columns: a",
+        "conversation_history": []
+    })
+    df = pd.DataFrame({"a": [1, 2, 3]})
+    monkeypatch.setattr(main, "get_database", lambda: db)
+    monkeypatch.setattr(main, "session_collection", lambda database: database.sessions)
+    monkeypatch.setattr(main, "get_cached_dataframe", lambda session_id: df)
+    monkeypatch.setattr(OpenAIManager, "create_embedding", classmethod(create_embedding))
+    monkeypatch.setattr(OpenAIManager, "generate_completion", classmethod(generate_completion))
+
+    async def ask(question):
+        query = Query(question=question)
+        analysis = await main.prepare_analysis("session", query)
+        if "cached_response" in analysis:
+            return "hit", await main.complete_cached_analysis("session", query, analysis)
+        await main.execute_analysis(analysis)
+        return "miss", await main.complete_analysis("session", query, analysis, "The total is 6.", None)
+
+    async def run():
+        return [await ask(question) for question in ("total of a", "total of a", "total of a", "mean of a", "total of a")]
+
+    answers = asyncio.run(run())
+
+    # Repeats hit, including after an earlier hit was recorded; once another
+    # question has been asked, the context differs and the answer is regenerated
+    assert [outcome for outcome, _ in answers] == ["miss", "hit", "hit", "miss", "miss"]
+    assert len(generated) == 3
+    assert answers[1][1].interpretation == "The total is 6."
+    assert len({response.conversation_id for _, response in answers}) == 5
+    assert len(db.sessions.document["conversation_history"]) == 5
@@ -0,0 +1,36 @@
+import numpy as np
+from openai_client import interpret_simple_result
+
+
+def test_integers_are_not_given_thousands_separators():
+    assert interpret_simple_result(2023) == "The result is 2023."
+    assert interpret_simple_result(np.int64(1234567)) == "The result is 1234567."
+
+
+def test_large_fractional_values_get_thousands_separators():
+    assert interpret_simple_result(1234567.5) == "The result is 1,234,567.5."
+    assert interpret_simple_result(12.5) == "The result is 12.5."
+
+
+def test_zero_dimensional_array_is_unwrapped():
+    assert interpret_simple_result({"type": "array", "data": 42, "shape": ()}) == "The result is 42."
+    assert interpret_simple_result({"type": "array", "data": True, "shape": ()}) == "The result is True."
+
+
+def test_single_row_dataframe_is_described_directly():
+    result = {"type": "dataframe", "data": [{"year": 2023, "sales": 10.5}], "shape": (1, 2)}
+
+    assert interpret_simple_result(result) == "The result is a single row: year: 2023, sales: 10.5."
+    assert interpret_simple_result({"type": "dataframe", "data": [], "shape": (0, 2)}) == \
+        "The analysis returned no matching rows."
+
+
+def test_series_with_at_most_one_value_is_described_directly():
+    assert interpret_simple_result({"type": "series", "data": {}, "length": 0}) == "The analysis returned no values."
+    assert interpret_simple_result({"type": "series", "data": {"north": 3}, "length": 1}) == "The result is north: 3."
+
+
+def test_larger_results_are_left_to_the_llm():
+    assert interpret_simple_result({"type": "series", "data": {"a": 1, "b": 2}, "length": 2}) is None
+    assert interpret_simple_result({"type": "dataframe", "data": [{}, {}], "shape": (2, 0)}) is None
+    assert interpret_simple_result([1, 2, 3]) is None
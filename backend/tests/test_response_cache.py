@@ -0,0 +1,57 @@
+import asyncio
+from response_cache import ResponseCache, context_key
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        self.documents.sort(key=lambda document: document[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.documents = self.documents[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+
+    async def insert_one(self, document):
+        self.documents.append(document)
+
+    def find(self, query, projection=None):
+        return FakeCursor([
+            document for document in self.documents
+            if all(document.get(key) == value for key, value in query.items())
+        ])
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.response_cache = FakeCollection()
+
+
+def test_lookup_requires_matching_conversation_context():
+    cache = ResponseCache(FakeDatabase())
+    first_turn = context_key("")
+    follow_up = context_key("Previous conversation context:\n\n1. Question: total sales\n")
+
+    async def run():
+        await cache.store("session", "total sales by region", [1.0, 0.0], first_turn, {"interpretation": "cached"})
+        return (
+            await cache.lookup("session", [1.0, 0.01], first_turn),
+            await cache.lookup("session", [1.0, 0.01], follow_up),
+            await cache.lookup("other", [1.0, 0.01], first_turn)
+        )
+
+    same_context, other_context, other_session = asyncio.run(run())
+
+    assert same_context == {"interpretation": "cached"}
+    assert other_context is None
+    assert other_session is None